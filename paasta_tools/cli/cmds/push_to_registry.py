@@ -20,6 +20,7 @@ import base64
 import binascii
 import json
 import os
+from typing import List
 from typing import Optional
 from typing import Tuple
 
@@ -106,13 +107,13 @@ def build_command(
     upstream_job_name: str,
     upstream_git_commit: str,
     image_version: Optional[str] = None,
-) -> str:
+) -> List[str]:
     # This is kinda dumb since we just cleaned the 'services-' off of the
     # service so we could validate it, but the Docker image will have the full
     # name with 'services-' so add it back.
     tag = build_docker_tag(upstream_job_name, upstream_git_commit, image_version)
-    cmd = f"docker push {tag}"
-    return cmd
+    # hand _run() an argv list directly so it doesn't have to shlex.split() it
+    return ["docker", "push", tag]
 
 
 def paasta_push_to_registry_impl(
@@ -142,10 +143,13 @@ def paasta_push_to_registry_impl(
 
     cmd = build_command(service, args.commit, image_version)
     loglines = []
-    returncode, output = _run(
+    # stream the push progress as it happens instead of holding on to all
+    # of it until docker exits; we don't use the output for anything else
+    returncode, _ = _run(
         cmd,
         timeout=3600,
         log=True,
+        stream=True,
         component="build",
         service=service,
         loglevel="debug",
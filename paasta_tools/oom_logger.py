@@ -35,14 +35,21 @@ log {
 """
 import argparse
 import json
+import os
+import queue
 import re
 import sys
-from collections import namedtuple
+import threading
+from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import NamedTuple
+from typing import Tuple
+from typing import Type
+from typing import TYPE_CHECKING
+from typing import Union
 
-import grpc
-from containerd.services.containers.v1 import containers_pb2
-from containerd.services.containers.v1 import containers_pb2_grpc
+from docker import APIClient
 from docker.errors import APIError
 
 from paasta_tools.cli.utils import get_instance_config
@@ -50,6 +57,11 @@ from paasta_tools.utils import _log
 from paasta_tools.utils import DEFAULT_LOGLEVEL
 from paasta_tools.utils import get_docker_client
 from paasta_tools.utils import load_system_paasta_config
+from paasta_tools.utils import time_cache
+
+if TYPE_CHECKING:
+    from containerd.services.containers.v1 import containers_pb2
+    from containerd.services.containers.v1 import containers_pb2_grpc
 
 
 # Sorry to any non-yelpers but this won't
@@ -65,22 +77,76 @@ try:
 except ImportError:
     clog = None
 
+# metric dimensions and counter per (service, instance, cluster, pool), built
+# on first use
+OOM_METRICS: Dict[Tuple[str, str, str, str], Tuple[Dict[str, str], Any]] = {}
+
+
+class LogLine(NamedTuple):
+    timestamp: int
+    hostname: str
+    container_id: str
+    cluster: str
+    service: str
+    instance: str
+    process_name: str
+    mesos_container_id: str
+    mem_limit: str
+
 
-LogLine = namedtuple(
-    "LogLine",
-    [
-        "timestamp",
-        "hostname",
-        "container_id",
-        "cluster",
-        "service",
-        "instance",
-        "process_name",
-        "mesos_container_id",
-        "mem_limit",
-    ],
+CONTAINERD_SOCKET = "unix:///run/containerd/containerd.sock"
+STDIN_READ_SIZE = 64 * 1024
+OOM_EVENT_QUEUE_SIZE = 1024
+# the only container env vars that end up in an OOM event
+CONTAINER_ENV_VARS = frozenset(
+    (
+        "PAASTA_SERVICE",
+        "PAASTA_INSTANCE",
+        "MESOS_CONTAINER_NAME",
+        "PAASTA_RESOURCE_MEM",
+    )
 )
 
+# alternatives sharing a literal prefix are grouped under it so the engine
+# only has to match that prefix once per position
+COMBINED_OOM_RE = re.compile(
+    rb"""
+    ^(?P<timestamp>\d+)\s # timestamp
+    (?P<hostname>[a-zA-Z0-9\-]+) # hostname
+    \s.*?(?:
+        Task\sin\s/(?:
+            # docker
+            docker/(?P<docker>\w{12})\w+
+            |
+            # kubernetes; non capturing, optional group for the qos cgroup
+            kubepods/(?:[a-zA-Z]+/)?pod[-\w]+/(?P<k8s>\w{12})\w+
+        )\skilled\sas\sa
+        |
+        oom-kill:.*?task_memcg=/(?:
+            # kubernetes structured; non-capturing, optional group for the qos cgroup
+            kubepods/(?:[a-zA-Z]+/)?pod[-\w]+/(?P<k8s_structured>\w{12})\w+,
+            |
+            # kubernetes with systemd cgroups; loosely match systemd slice and containerid
+            kubepods\.slice/[^,]+docker-(?P<k8s_systemd>\w{12})\w+\.scope,
+            |
+            # kubernetes with containerd and systemd cgroups
+            [^,]*\.slice/[^,]*cri-containerd:(?P<k8s_containerd_systemd>\w{64})
+            |
+            # kubernetes with containerd and structured systemd cgroups
+            kubepods\.slice/[^,]*cri-containerd-(?P<k8s_containerd_systemd_structured>\w{64})
+        )
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+def cpu_id(value: str) -> int:
+    cpu = int(value)
+    if cpu < 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid CPU id")
+    return cpu
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="paasta_oom_logger")
@@ -89,126 +155,115 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Use containerd to inspect containers, otherwise use docker",
     )
+    parser.add_argument(
+        "--cpu-affinity",
+        type=cpu_id,
+        default=None,
+        metavar="CPU",
+        help="Pin the process, including its stdin reader and any gRPC threads, "
+        "to the given CPU",
+    )
     return parser.parse_args()
 
 
 def capture_oom_events_from_stdin():
-    process_name_regex = re.compile(
-        r"^\d+\s[a-zA-Z0-9\-]+\s.*\]\s(.+)\sinvoked\soom-killer:"
-    )
-    oom_regex_docker = re.compile(
-        r"^(\d+)\s([a-zA-Z0-9\-]+)\s.*Task in /docker/(\w{12})\w+ killed as a"
-    )
-    oom_regex_kubernetes = re.compile(
-        r"""
-        ^(\d+)\s # timestamp
-        ([a-zA-Z0-9\-]+) # hostname
-        \s.*Task\sin\s/kubepods/(?:[a-zA-Z]+/)? # start of message; non capturing, optional group for the qos cgroup
-        pod[-\w]+/(\w{12})\w+\s # containerid
-        killed\sas\sa*  # eom
-        """,
-        re.VERBOSE,
-    )
-    oom_regex_kubernetes_containerd_systemd_cgroup = re.compile(
-        r"""
-        ^(\d+)\s # timestamp
-        ([a-zA-Z0-9\-]+) # hostname
-        \s.*oom-kill:.*task_memcg=/.*\.slice/.* # loosely match systemd slice and containerid
-        cri-containerd:(\w{64}).*$ # containerid
-        """,
-        re.VERBOSE,
-    )
-
-    oom_regex_kubernetes_containerd_systemd_cgroup_structured = re.compile(
-        r"""
-        ^(\d+)\s # timestamp
-        ([a-zA-Z0-9\-]+) # hostname
-        \s.*oom-kill:.*task_memcg=/kubepods\.slice/.* # match systemd slice and containerid
-        cri-containerd-(\w{64}).*$ # containerid
-        """,
-        re.VERBOSE,
-    )
-    oom_regex_kubernetes_structured = re.compile(
-        r"""
-        ^(\d+)\s # timestamp
-        ([a-zA-Z0-9\-]+) # hostname
-        \s.*oom-kill:.*task_memcg=/kubepods/(?:[a-zA-Z]+/)? # start of message; non-capturing, optional group for the qos cgroup
-        pod[-\w]+/(\w{12})\w+,.*$ # containerid
-        """,
-        re.VERBOSE,
-    )
-    oom_regex_kubernetes_systemd_cgroup = re.compile(
-        r"""
-        ^(\d+)\s # timestamp
-        ([a-zA-Z0-9\-]+) # hostname
-        \s.*oom-kill:.*task_memcg=/kubepods\.slice/[^,]+docker-(\w{12})\w+\.scope,.*$ # loosely match systemd slice and containerid
-        """,
-        re.VERBOSE,
-    )
-    event_detail_regexes = [
-        oom_regex_docker,
-        oom_regex_kubernetes,
-        oom_regex_kubernetes_structured,
-        oom_regex_kubernetes_systemd_cgroup,
-        oom_regex_kubernetes_containerd_systemd_cgroup,
-        oom_regex_kubernetes_containerd_systemd_cgroup_structured,
-    ]
-
     process_name = ""
+    leftover = b""
     while True:
+        # read raw bytes so that only the fields we actually capture get
+        # decoded; read1() returns whatever is already available rather than
+        # blocking until a full chunk has arrived
         try:
-            syslog = sys.stdin.readline()
+            chunk = sys.stdin.buffer.read1(STDIN_READ_SIZE)
         except StopIteration:
+            chunk = b""
+        if chunk:
+            buf = leftover + chunk
+            lines = buf.split(b"\n")
+            # the last element is an incomplete line; carry it over
+            leftover = lines.pop()
+            # most chunks contain no OOM markers at all ("oom-kill" also
+            # covers "invoked oom-killer:"), so skip them without looking
+            # at individual lines
+            if b"oom-kill" not in buf and b"killed as a" not in buf:
+                continue
+        elif leftover:
+            # EOF without a trailing newline
+            lines, leftover = [leftover], b""
+        else:
             break
-        if not syslog:
-            break
-        r = process_name_regex.search(syslog)
-        if r:
-            process_name = r.group(1)
-        for expression in event_detail_regexes:
-            r = expression.search(syslog)
+        for syslog in lines:
+            # the process name sits between the last "] " (end of the kernel
+            # timestamp) and " invoked oom-killer:", so plain string searches
+            # are enough to pull it out
+            end = syslog.rfind(b" invoked oom-killer:")
+            if end >= 0:
+                start = syslog.rfind(b"] ", 0, end) + 2
+                if 2 <= start < end:
+                    process_name = syslog[start:end].decode("utf-8", errors="replace")
+            # cheap substring check (mirroring the syslog-ng filter) so lines
+            # that cannot be an OOM event never reach the regex engine
+            if b"killed as a" not in syslog and b"oom-kill:" not in syslog:
+                continue
+            r = COMBINED_OOM_RE.search(syslog)
             if r:
-                yield (int(r.group(1)), r.group(2), r.group(3), process_name)
+                # the only capturing group after hostname is the container id
+                # of whichever alternative matched, so lastgroup names it
+                yield (
+                    int(r.group("timestamp")),
+                    r.group("hostname").decode("ascii"),
+                    r.group(r.lastgroup).decode("ascii"),
+                    process_name,
+                )
                 process_name = ""
-                break
+
+
+def enqueue_oom_events_from_stdin(events: queue.Queue) -> None:
+    """Parse OOM events off stdin in the background so that slow container
+    lookups or logging backends don't stop us from draining syslog-ng."""
+    try:
+        for event in capture_oom_events_from_stdin():
+            events.put(event)
+    except Exception as e:
+        # hand the error over to main(), otherwise it would only show up in
+        # this thread and we'd exit as if we had reached EOF
+        events.put(e)
+    finally:
+        # let main() know that no more events are coming
+        events.put(None)
+
+
+def filter_container_env(env: Iterable[str]) -> Dict[str, str]:
+    env_vars = {}
+    for i in env:
+        # PaaSTA containers carry lots of env vars but we only need a
+        # handful, so avoid splitting (and copying) the rest
+        idx = i.find("=")
+        if idx < 0:
+            continue
+        name = i[:idx]
+        if name in CONTAINER_ENV_VARS:
+            env_vars[name] = i[idx + 1 :]
+    return env_vars
 
 
 def get_container_env_as_dict(
     is_cri_containerd: bool, container_inspect: dict
 ) -> Dict[str, str]:
-    env_vars = {}
     if is_cri_containerd:
         config = container_inspect.get("process")
         env_key = "env"
     else:
         config = container_inspect.get("Config")
         env_key = "Env"
-    if config is not None:
-        env = config.get(env_key, [])
-        for i in env:
-            name, _, value = i.partition("=")
-            env_vars[name] = value
-    return env_vars
+    if config is None:
+        return {}
+    return filter_container_env(config.get(env_key, []))
 
 
 def log_to_clog(log_line):
     """Send the event to 'tmp_paasta_oom_events'."""
-    line = (
-        '{"timestamp": %d, "hostname": "%s", "container_id": "%s", "cluster": "%s", '
-        '"service": "%s", "instance": "%s", "process_name": "%s", '
-        '"mesos_container_id": "%s", "mem_limit": "%s"}'
-        % (
-            log_line.timestamp,
-            log_line.hostname,
-            log_line.container_id,
-            log_line.cluster,
-            log_line.service,
-            log_line.instance,
-            log_line.process_name,
-            log_line.mesos_container_id,
-            log_line.mem_limit,
-        )
-    )
+    line = json.dumps(log_line._asdict(), separators=(",", ":"))
     clog.log_line("tmp_paasta_oom_events", line)
 
 
@@ -231,35 +286,68 @@ def log_to_paasta(log_line):
     )
 
 
+# the pool only changes on a (rare) soa-configs update, so there's no need to
+# re-read the instance config from disk for every OOM event
+@time_cache(ttl=600, maxsize=256)
+def get_instance_pool(service: str, instance: str, cluster: str) -> str:
+    return get_instance_config(
+        service=service, instance=instance, cluster=cluster
+    ).get_pool()
+
+
 def send_sfx_event(service, instance, cluster):
     if yelp_meteorite:
-        service_instance_config = get_instance_config(
-            service=service, instance=instance, cluster=cluster
-        )
-        dimensions = {
-            "paasta_cluster": cluster,
-            "paasta_instance": instance,
-            "paasta_service": service,
-            "paasta_pool": service_instance_config.get_pool(),
-        }
+        pool = get_instance_pool(service, instance, cluster)
+        metrics_key = (service, instance, cluster, pool)
+        metrics = OOM_METRICS.get(metrics_key)
+        if metrics is None:
+            dimensions = {
+                "paasta_cluster": cluster,
+                "paasta_instance": instance,
+                "paasta_service": service,
+                "paasta_pool": pool,
+            }
+            counter = yelp_meteorite.create_counter(
+                "paasta.service.oom_count",
+                default_dimensions=dimensions,
+            )
+            metrics = OOM_METRICS[metrics_key] = (dimensions, counter)
+        dimensions, counter = metrics
         yelp_meteorite.events.emit_event(
             "paasta.service.oom_events",
             dimensions=dimensions,
         )
-        counter = yelp_meteorite.create_counter(
-            "paasta.service.oom_count",
-            default_dimensions=dimensions,
-        )
         counter.count()
 
 
-def get_containerd_container(container_id: str) -> containers_pb2.Container:
-    with grpc.insecure_channel("unix:///run/containerd/containerd.sock") as channel:
-        containersv1 = containers_pb2_grpc.ContainersStub(channel)
-        return containersv1.Get(
-            containers_pb2.GetContainerRequest(id=container_id),
-            metadata=(("containerd-namespace", "k8s.io"),),
-        ).container
+def get_containerd_container(
+    containersv1: "containers_pb2_grpc.ContainersStub", container_id: str
+) -> "containers_pb2.Container":
+    from containerd.services.containers.v1 import containers_pb2
+
+    return containersv1.Get(
+        containers_pb2.GetContainerRequest(id=container_id),
+        metadata=(("containerd-namespace", "k8s.io"),),
+    ).container
+
+
+# OOM storms tend to log many events for the same container within a few
+# seconds, so avoid asking docker/containerd about it every single time
+@time_cache(ttl=30, maxsize=256)
+def get_container_env_vars(
+    container_id: str,
+    is_containerd: bool,
+    client: Union[APIClient, "containers_pb2_grpc.ContainersStub"],
+) -> Dict[str, str]:
+    if is_containerd:
+        # then we're using containerd to inspect containers
+        container_info = get_containerd_container(client, container_id)
+        # json.loads() detects and decodes the (UTF-8) bytes itself
+        container_inspect = json.loads(container_info.spec.value)
+    else:
+        # we're using docker to inspect containers
+        container_inspect = client.inspect_container(resource_id=container_id)
+    return get_container_env_as_dict(is_containerd, container_inspect)
 
 
 def main():
@@ -267,6 +355,12 @@ def main():
         print("CLog logger unavailable, exiting.", file=sys.stderr)
         sys.exit(1)
     args = parse_args()
+    if args.cpu_affinity is not None:
+        # this runs before any other thread is started, so every thread
+        # inherits the affinity and the whole process shares that one CPU.
+        # That's fine as the threads spend most of their time blocked on
+        # stdin, docker/containerd or clog, none of which holds a CPU.
+        os.sched_setaffinity(0, {args.cpu_affinity})
     clog.config.configure(
         scribe_host="169.254.255.254",
         scribe_port=1463,
@@ -274,47 +368,57 @@ def main():
         scribe_disable=False,
     )
     cluster = load_system_paasta_config().get_cluster()
-    client = get_docker_client()
-    for (
-        timestamp,
-        hostname,
-        container_id,
-        process_name,
-    ) in capture_oom_events_from_stdin():
-        if args.containerd:
-            # then we're using containerd to inspect containers
+    channel = None
+    containerd_errors: Tuple[Type[Exception], ...] = ()
+    if args.containerd:
+        # grpc and the containerd protobufs are slow to import, so only
+        # load them when they're actually going to be used
+        import grpc
+        from containerd.services.containers.v1 import containers_pb2_grpc
+
+        # a single channel is reused for every event rather than reconnecting
+        channel = grpc.insecure_channel(CONTAINERD_SOCKET)
+        client = containers_pb2_grpc.ContainersStub(channel)
+        containerd_errors = (grpc.RpcError,)
+    else:
+        client = get_docker_client()
+    events: queue.Queue = queue.Queue(maxsize=OOM_EVENT_QUEUE_SIZE)
+    threading.Thread(
+        target=enqueue_oom_events_from_stdin, args=(events,), daemon=True
+    ).start()
+    try:
+        for event in iter(events.get, None):
+            if isinstance(event, Exception):
+                raise event
+            timestamp, hostname, container_id, process_name = event
             try:
-                container_info = get_containerd_container(container_id)
-            except grpc.RpcError as e:
+                env_vars = get_container_env_vars(container_id, args.containerd, client)
+            except containerd_errors as e:
                 print("An error occurred while getting the container:", e)
                 continue
-            container_spec_raw = container_info.spec.value.decode("utf-8")
-            container_inspect = json.loads(container_spec_raw)
-        else:
-            # we're using docker to inspect containers
-            try:
-                container_inspect = client.inspect_container(resource_id=container_id)
             except (APIError):
                 continue
-        env_vars = get_container_env_as_dict(args.containerd, container_inspect)
-        service = env_vars.get("PAASTA_SERVICE", "unknown")
-        instance = env_vars.get("PAASTA_INSTANCE", "unknown")
-        mesos_container_id = env_vars.get("MESOS_CONTAINER_NAME", "mesos-null")
-        mem_limit = env_vars.get("PAASTA_RESOURCE_MEM", "unknown")
-        log_line = LogLine(
-            timestamp=timestamp,
-            hostname=hostname,
-            container_id=container_id,
-            cluster=cluster,
-            service=service,
-            instance=instance,
-            process_name=process_name,
-            mesos_container_id=mesos_container_id,
-            mem_limit=mem_limit,
-        )
-        log_to_clog(log_line)
-        log_to_paasta(log_line)
-        send_sfx_event(service, instance, cluster)
+            service = env_vars.get("PAASTA_SERVICE", "unknown")
+            instance = env_vars.get("PAASTA_INSTANCE", "unknown")
+            mesos_container_id = env_vars.get("MESOS_CONTAINER_NAME", "mesos-null")
+            mem_limit = env_vars.get("PAASTA_RESOURCE_MEM", "unknown")
+            log_line = LogLine(
+                timestamp=timestamp,
+                hostname=hostname,
+                container_id=container_id,
+                cluster=cluster,
+                service=service,
+                instance=instance,
+                process_name=process_name,
+                mesos_container_id=mesos_container_id,
+                mem_limit=mem_limit,
+            )
+            log_to_clog(log_line)
+            log_to_paasta(log_line)
+            send_sfx_event(service, instance, cluster)
+    finally:
+        if channel is not None:
+            channel.close()
 
 
 if __name__ == "__main__":
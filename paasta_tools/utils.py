@@ -195,9 +195,10 @@ _CacheRetT = TypeVar("_CacheRetT")
 
 
 class time_cache:
-    def __init__(self, ttl: float = 0) -> None:
+    def __init__(self, ttl: float = 0, maxsize: Optional[int] = None) -> None:
         self.configs: Dict[Tuple, TimeCacheEntry] = {}
         self.ttl = ttl
+        self.maxsize = maxsize
 
     def __call__(self, f: Callable[..., _CacheRetT]) -> Callable[..., _CacheRetT]:
         def cache(*args: Any, **kwargs: Any) -> _CacheRetT:
@@ -214,14 +215,33 @@ class time_cache:
                 or (key not in self.configs)
                 or (time.time() - self.configs[key]["fetch_time"] > ttl)
             ):
+                data = f(*args, **kwargs)
+                if self.maxsize is not None:
+                    # re-insert refreshed entries so that configs stays in
+                    # fetch order, oldest first
+                    self.configs.pop(key, None)
+                    self.evict(self.maxsize - 1)
                 self.configs[key] = {
-                    "data": f(*args, **kwargs),
+                    "data": data,
                     "fetch_time": time.time(),
                 }
             return self.configs[key]["data"]
 
+        cache.cache_clear = self.configs.clear  # type: ignore
         return cache
 
+    def evict(self, maxsize: int) -> None:
+        """Drop expired entries, then the oldest ones until at most maxsize
+        are left."""
+        now = time.time()
+        while self.configs:
+            oldest = next(iter(self.configs))
+            if len(self.configs) <= maxsize and not (
+                self.ttl and now - self.configs[oldest]["fetch_time"] > self.ttl
+            ):
+                break
+            del self.configs[oldest]
+
 
 _SortDictsT = TypeVar("_SortDictsT", bound=Mapping)
 
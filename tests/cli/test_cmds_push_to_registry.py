@@ -29,7 +29,7 @@ from paasta_tools.cli.cmds.push_to_registry import retag_versioned_image
 @patch("paasta_tools.cli.cmds.push_to_registry.build_docker_tag", autospec=True)
 def test_build_command(mock_build_docker_tag):
     mock_build_docker_tag.return_value = "my-docker-registry/services-foo:paasta-asdf"
-    expected = "docker push my-docker-registry/services-foo:paasta-asdf"
+    expected = ["docker", "push", "my-docker-registry/services-foo:paasta-asdf"]
     actual = build_command("foo", "bar")
     assert actual == expected
 
@@ -51,9 +51,11 @@ def test_push_to_registry_run_fail(
     mock_build_command,
     mock_is_docker_image_already_in_registry,
 ):
-    mock_build_command.return_value = (
-        "docker push my-docker-registry/services-foo:paasta-asdf"
-    )
+    mock_build_command.return_value = [
+        "docker",
+        "push",
+        "my-docker-registry/services-foo:paasta-asdf",
+    ]
     mock_is_docker_image_already_in_registry.return_value = False
     mock_run.return_value = (1, "Bad")
     args = MagicMock(image_version=None)
@@ -79,9 +81,11 @@ def test_push_to_registry_success(
     mock_is_docker_image_already_in_registry,
 ):
     args, _ = parse_args(["push-to-registry", "-s", "foo", "-c", "abcd" * 10])
-    mock_build_command.return_value = (
-        "docker push my-docker-registry/services-foo:paasta-asdf"
-    )
+    mock_build_command.return_value = [
+        "docker",
+        "push",
+        "my-docker-registry/services-foo:paasta-asdf",
+    ]
     mock_run.return_value = (0, "Success")
     mock_is_docker_image_already_in_registry.return_value = False
     assert paasta_push_to_registry(args) == 0
@@ -112,16 +116,19 @@ def test_push_to_registry_force(
     args, _ = parse_args(
         ["push-to-registry", "-s", "foo", "-c", "abcd" * 10, "--force"]
     )
-    mock_build_command.return_value = (
-        "docker push fake_registry/services-foo:paasta-abcd"
-    )
+    mock_build_command.return_value = [
+        "docker",
+        "push",
+        "fake_registry/services-foo:paasta-abcd",
+    ]
     mock_run.return_value = (0, "Success")
     assert paasta_push_to_registry(args) == 0
     assert not mock_is_docker_image_already_in_registry.called
     mock_run.assert_called_once_with(
-        "docker push fake_registry/services-foo:" "paasta-abcd",
+        ["docker", "push", "fake_registry/services-foo:paasta-abcd"],
         component="build",
         log=True,
+        stream=True,
         loglevel="debug",
         service="foo",
         timeout=3600,
@@ -385,8 +392,8 @@ def test_push_to_registry_with_image_version(
     )
     mock_retag_versioned_image.return_value = 0
     mock_build_command.side_effect = [
-        "docker push unversioned",
-        "docker push with-image-version",
+        ["docker", "push", "unversioned"],
+        ["docker", "push", "with-image-version"],
     ]
 
     mock_run.return_value = (0, "Success")
@@ -402,17 +409,19 @@ def test_push_to_registry_with_image_version(
     mock_run.assert_has_calls(
         [
             call(
-                "docker push unversioned",
+                ["docker", "push", "unversioned"],
                 component="build",
                 log=True,
+                stream=True,
                 loglevel="debug",
                 service="foo",
                 timeout=3600,
             ),
             call(
-                "docker push with-image-version",
+                ["docker", "push", "with-image-version"],
                 component="build",
                 log=True,
+                stream=True,
                 loglevel="debug",
                 service="foo",
                 timeout=3600,
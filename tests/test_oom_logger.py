@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import json
+import queue
 
 import pytest
 from mock import MagicMock
@@ -19,182 +20,195 @@ from mock import Mock
 from mock import patch
 
 from paasta_tools.oom_logger import capture_oom_events_from_stdin
+from paasta_tools.oom_logger import enqueue_oom_events_from_stdin
+from paasta_tools.oom_logger import get_container_env_as_dict
+from paasta_tools.oom_logger import get_container_env_vars
+from paasta_tools.oom_logger import get_instance_pool
 from paasta_tools.oom_logger import log_to_clog
 from paasta_tools.oom_logger import LogLine
 from paasta_tools.oom_logger import main
+from paasta_tools.oom_logger import OOM_METRICS
+from paasta_tools.oom_logger import parse_args
 from paasta_tools.oom_logger import send_sfx_event
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    get_container_env_vars.cache_clear()
+    get_instance_pool.cache_clear()
+    OOM_METRICS.clear()
+
+
 @pytest.fixture
 def sys_stdin():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
-        "killed as a result of limit of "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"killed as a result of limit of "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_burstable_qos():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/kubepods/burstable/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
-        "killed as a result of limit of /kubepods/burstable/"
-        "podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/kubepods/burstable/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
+        b"killed as a result of limit of /kubepods/burstable/"
+        b"podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_guaranteed_qos():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/kubepods/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
-        "killed as a result of limit of /kubepods/"
-        "podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/kubepods/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
+        b"killed as a result of limit of /kubepods/"
+        b"podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_besteffort_qos():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/kubepods/besteffort/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
-        "killed as a result of limit of /kubepods/besteffort/"
-        "podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
-        "0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/kubepods/besteffort/podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772 "
+        b"killed as a result of limit of /kubepods/besteffort/"
+        b"podf91e9681-4741-4ef4-8f5a-182c5683df8b/"
+        b"0e4a814eda03622476ff47871e6c397e5b8747af209b44f3b3e1c5289b0f9772\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_structured_burstable_qos():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
-        "some random line2\n",
-        "1500316300 dev37-devc [541471.893603] oom-kill:constraint=CONSTRAINT_MEMCG,"
-        "nodemask=(null),cpuset=1b6f55bfbed10cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
-        "mems_allowed=0-1,oom_memcg=/kubepods/burstable/podb56c3a7a-a84d-4f84-b97e-446c4e705259/"
-        "0e4a814eda030cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
-        "task_memcg=/kubepods/burstable/podb56c3a7a-a84d-4f84-b97e-446c4e705259/"
-        "0e4a814eda030cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
-        "task=kafka_exporter,pid=43716,uid=65534\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
+        b"some random line2\n",
+        b"1500316300 dev37-devc [541471.893603] oom-kill:constraint=CONSTRAINT_MEMCG,"
+        b"nodemask=(null),cpuset=1b6f55bfbed10cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
+        b"mems_allowed=0-1,oom_memcg=/kubepods/burstable/podb56c3a7a-a84d-4f84-b97e-446c4e705259/"
+        b"0e4a814eda030cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
+        b"task_memcg=/kubepods/burstable/podb56c3a7a-a84d-4f84-b97e-446c4e705259/"
+        b"0e4a814eda030cdc2bb6944078eaefd3278f8f9b3a9725c4ddffb722752a2279,"
+        b"task=kafka_exporter,pid=43716,uid=65534\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_structured_burstable_systemd_cgroup():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
-        "some random line2\n",
-        "1500316300 dev37-devc [541471.893603] oom-kill:constraint=CONSTRAINT_MEMCG,"
-        "nodemask=(null),cpuset=docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,"
-        "mems_allowed=0,oom_memcg=/kubepods.slice/kubepods-burstable.slice/"
-        "kubepods-burstable-pod8a0a7a03_d305_4ebc_83ad_91180c9d5ef9.slice/"
-        "docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,"
-        "task_memcg=/kubepods.slice/kubepods-burstable.slice/kubepods-burstable-pod8a0a7a03_d305_4ebc_83ad_91180c9d5ef9.slice/"
-        "docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,task=apache2,pid=1757658,uid=0\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] apache2 invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n",
+        b"some random line2\n",
+        b"1500316300 dev37-devc [541471.893603] oom-kill:constraint=CONSTRAINT_MEMCG,"
+        b"nodemask=(null),cpuset=docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,"
+        b"mems_allowed=0,oom_memcg=/kubepods.slice/kubepods-burstable.slice/"
+        b"kubepods-burstable-pod8a0a7a03_d305_4ebc_83ad_91180c9d5ef9.slice/"
+        b"docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,"
+        b"task_memcg=/kubepods.slice/kubepods-burstable.slice/kubepods-burstable-pod8a0a7a03_d305_4ebc_83ad_91180c9d5ef9.slice/"
+        b"docker-e7ba37bd37089f8b1fda33c6f1fe753421ca6216518594bc73bca2ead7c13ba0.scope,task=apache2,pid=1757658,uid=0\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_containerd_systemd_cgroup_structured():
     return [
-        "some random line1\n",
-        "1720128512 dev37-devc [ 7195.442797] python3 invoked oom-killer: "
-        "gfp_mask=0xcc0(GFP_KERNEL), order=0, oom_score_adj=999\n",
-        "some random line2\n",
-        "1720128512 dev37-devc [ 7195.442928] oom-kill:constraint=CONSTRAINT_MEMCG,"
-        "cpuset=cri-containerd-e216d2f1e6c625d363c71edb6b3cbab5a9e1b447641b61028d0b94b077adf27c.scope,"
-        "mems_allowed=0,oom_memcg=/kubepods.slice/kubepods-burstable.slice/"
-        "kubepods-burstable-pod08768c36_163c_40e5_8e49_09cf42ff5046.slice,"
-        "task_memcg=/kubepods.slice/kubepods-burstable.slice/kubepods-burstable-pod08768c36_163c_40e5_8e49_09cf42ff5046.slice/"
-        "cri-containerd-e216d2f1e6c625d363c71edb6b3cbab5a9e1b447641b61028d0b94b077adf27c.scope,task=python3,pid=485850,uid=33\n",
+        b"some random line1\n",
+        b"1720128512 dev37-devc [ 7195.442797] python3 invoked oom-killer: "
+        b"gfp_mask=0xcc0(GFP_KERNEL), order=0, oom_score_adj=999\n",
+        b"some random line2\n",
+        b"1720128512 dev37-devc [ 7195.442928] oom-kill:constraint=CONSTRAINT_MEMCG,"
+        b"cpuset=cri-containerd-e216d2f1e6c625d363c71edb6b3cbab5a9e1b447641b61028d0b94b077adf27c.scope,"
+        b"mems_allowed=0,oom_memcg=/kubepods.slice/kubepods-burstable.slice/"
+        b"kubepods-burstable-pod08768c36_163c_40e5_8e49_09cf42ff5046.slice,"
+        b"task_memcg=/kubepods.slice/kubepods-burstable.slice/kubepods-burstable-pod08768c36_163c_40e5_8e49_09cf42ff5046.slice/"
+        b"cri-containerd-e216d2f1e6c625d363c71edb6b3cbab5a9e1b447641b61028d0b94b077adf27c.scope,task=python3,pid=485850,uid=33\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_kubernetes_containerd_systemd_cgroup():
     return [
-        "some random line1\n",
-        "1720128512 dev208-uswest1adevc [42201.484624] python3 invoked oom-killer: "
-        "gfp_mask=0xcc0(GFP_KERNEL), order=0, oom_score_adj=999\n",
-        "some random line2\n",
-        "1720128512 dev208-uswest1adevc [42201.484749] oom-kill:constraint=CONSTRAINT_MEMCG,"
-        "nodemask=(null),cpuset=kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
-        "cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,"
-        "mems_allowed=0,oom_memcg=/system.slice/kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
-        "cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,"
-        "task_memcg=/system.slice/kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
-        "cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,task=python3,pid=4190418,uid=33\n",
+        b"some random line1\n",
+        b"1720128512 dev208-uswest1adevc [42201.484624] python3 invoked oom-killer: "
+        b"gfp_mask=0xcc0(GFP_KERNEL), order=0, oom_score_adj=999\n",
+        b"some random line2\n",
+        b"1720128512 dev208-uswest1adevc [42201.484749] oom-kill:constraint=CONSTRAINT_MEMCG,"
+        b"nodemask=(null),cpuset=kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
+        b"cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,"
+        b"mems_allowed=0,oom_memcg=/system.slice/kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
+        b"cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,"
+        b"task_memcg=/system.slice/kubepods-burstable-pod73331cbb_9b96_4a62_9702_46a56ad49dd0.slice:"
+        b"cri-containerd:52f9ece9bcf929a08951aa3b4312fbec50890d82b58988f91a0aa9dc96ebc199,task=python3,pid=4190418,uid=33\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_process_name_with_slashes():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] /nail/live/yelp invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
-        "killed as a result of limit of "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] /nail/live/yelp invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"killed as a result of limit of "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_process_name_with_spaces():
     return [
-        "some random line1\n",
-        "1500316299 dev37-devc [30533610.306528] python batch/ke invoked oom-killer: "
-        "gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
-        "killed as a result of limit of "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
+        b"some random line1\n",
+        b"1500316299 dev37-devc [30533610.306528] python batch/ke invoked oom-killer: "
+        b"gfp_mask=0x24000c0, order=0, oom_score_adj=0\n,"
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"killed as a result of limit of "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
     ]
 
 
 @pytest.fixture
 def sys_stdin_without_process_name():
     return [
-        "some random line1\n",
-        "1500216300 dev37-devc [1140036.678311] Task in "
-        "/docker/e3a1057fdd485f5dffe48f1584e6f30c2bf6d30107d95518aea32bbb8bb29560 "
-        "killed as a result of limit of "
-        "/docker/e3a1057fdd485f5dffe48f1584e6f30c2bf6d30107d95518aea32bbb8bb29560\n,"
-        "some random line2\n",
-        "1500316300 dev37-devc [30533610.306529] Task in "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
-        "killed as a result of limit of "
-        "/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
+        b"some random line1\n",
+        b"1500216300 dev37-devc [1140036.678311] Task in "
+        b"/docker/e3a1057fdd485f5dffe48f1584e6f30c2bf6d30107d95518aea32bbb8bb29560 "
+        b"killed as a result of limit of "
+        b"/docker/e3a1057fdd485f5dffe48f1584e6f30c2bf6d30107d95518aea32bbb8bb29560\n,"
+        b"some random line2\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"killed as a result of limit of "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n",
     ]
 
 
@@ -255,9 +269,9 @@ def log_line_containerd():
     )
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin(mock_sys_stdin, sys_stdin):
-    mock_sys_stdin.readline.side_effect = sys_stdin
+    mock_sys_stdin.buffer.read1.side_effect = sys_stdin
     test_output = []
     for a_tuple in capture_oom_events_from_stdin():
         test_output.append(a_tuple)
@@ -265,7 +279,7 @@ def test_capture_oom_events_from_stdin(mock_sys_stdin, sys_stdin):
     assert test_output == [(1500316300, "dev37-devc", "a687af92e281", "apache2")]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_kubernetes_qos(
     mock_sys_stdin,
     sys_stdin_kubernetes_besteffort_qos,
@@ -277,43 +291,47 @@ def test_capture_oom_events_from_stdin_kubernetes_qos(
         sys_stdin_kubernetes_burstable_qos,
         sys_stdin_kubernetes_guaranteed_qos,
     ):
-        mock_sys_stdin.readline.side_effect = qos
+        mock_sys_stdin.buffer.read1.side_effect = qos
         test_output = []
         for a_tuple in capture_oom_events_from_stdin():
             test_output.append(a_tuple)
         assert test_output == [(1500316300, "dev37-devc", "0e4a814eda03", "apache2")]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_kubernetes_structured_qos(
     mock_sys_stdin,
     sys_stdin_kubernetes_structured_burstable_qos,
 ):
-    mock_sys_stdin.readline.side_effect = sys_stdin_kubernetes_structured_burstable_qos
+    mock_sys_stdin.buffer.read1.side_effect = (
+        sys_stdin_kubernetes_structured_burstable_qos
+    )
     test_output = []
     for a_tuple in capture_oom_events_from_stdin():
         test_output.append(a_tuple)
     assert test_output == [(1500316300, "dev37-devc", "0e4a814eda03", "apache2")]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_kubernetes_structured_burstable_systemd_cgroup(
     mock_sys_stdin,
     sys_stdin_kubernetes_structured_burstable_systemd_cgroup,
 ):
-    mock_sys_stdin.readline.side_effect = (
+    mock_sys_stdin.buffer.read1.side_effect = (
         sys_stdin_kubernetes_structured_burstable_systemd_cgroup
     )
     test_output = [a_tuple for a_tuple in capture_oom_events_from_stdin()]
     assert test_output == [(1500316300, "dev37-devc", "e7ba37bd3708", "apache2")]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_kubernetes_containerd_systemd_cgroup(
     mock_sys_stdin,
     sys_stdin_kubernetes_containerd_systemd_cgroup,
 ):
-    mock_sys_stdin.readline.side_effect = sys_stdin_kubernetes_containerd_systemd_cgroup
+    mock_sys_stdin.buffer.read1.side_effect = (
+        sys_stdin_kubernetes_containerd_systemd_cgroup
+    )
     test_output = [a_tuple for a_tuple in capture_oom_events_from_stdin()]
     assert test_output == [
         (
@@ -325,12 +343,12 @@ def test_capture_oom_events_from_stdin_kubernetes_containerd_systemd_cgroup(
     ]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_kubernetes_containerd_systemd_cgroup_structured(
     mock_sys_stdin,
     sys_stdin_kubernetes_containerd_systemd_cgroup_structured,
 ):
-    mock_sys_stdin.readline.side_effect = (
+    mock_sys_stdin.buffer.read1.side_effect = (
         sys_stdin_kubernetes_containerd_systemd_cgroup_structured
     )
     test_output = [a_tuple for a_tuple in capture_oom_events_from_stdin()]
@@ -344,11 +362,11 @@ def test_capture_oom_events_from_stdin_kubernetes_containerd_systemd_cgroup_stru
     ]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_with_slashes(
     mock_sys_stdin, sys_stdin_process_name_with_slashes
 ):
-    mock_sys_stdin.readline.side_effect = sys_stdin_process_name_with_slashes
+    mock_sys_stdin.buffer.read1.side_effect = sys_stdin_process_name_with_slashes
     test_output = []
     for a_tuple in capture_oom_events_from_stdin():
         test_output.append(a_tuple)
@@ -358,11 +376,11 @@ def test_capture_oom_events_from_stdin_with_slashes(
     ]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_with_spaces(
     mock_sys_stdin, sys_stdin_process_name_with_spaces
 ):
-    mock_sys_stdin.readline.side_effect = sys_stdin_process_name_with_spaces
+    mock_sys_stdin.buffer.read1.side_effect = sys_stdin_process_name_with_spaces
     test_output = []
     for a_tuple in capture_oom_events_from_stdin():
         test_output.append(a_tuple)
@@ -372,11 +390,11 @@ def test_capture_oom_events_from_stdin_with_spaces(
     ]
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.sys.stdin")
 def test_capture_oom_events_from_stdin_without_process_name(
     mock_sys_stdin, sys_stdin_without_process_name
 ):
-    mock_sys_stdin.readline.side_effect = sys_stdin_without_process_name
+    mock_sys_stdin.buffer.read1.side_effect = sys_stdin_without_process_name
     test_output = []
     for a_tuple in capture_oom_events_from_stdin():
         test_output.append(a_tuple)
@@ -387,6 +405,75 @@ def test_capture_oom_events_from_stdin_without_process_name(
     ]
 
 
+@patch("paasta_tools.oom_logger.sys.stdin")
+def test_capture_oom_events_from_stdin_ignores_unrelated_lines(mock_sys_stdin):
+    mock_sys_stdin.buffer.read1.side_effect = [
+        b"1500316299 dev37-devc [30533610.306528] some unrelated kernel message\n",
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"was not killed\n",
+    ]
+    assert list(capture_oom_events_from_stdin()) == []
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
+def test_capture_oom_events_from_stdin_lines_split_across_reads(
+    mock_sys_stdin, sys_stdin_process_name_with_slashes
+):
+    data = b"".join(sys_stdin_process_name_with_slashes).rstrip(b"\n")
+    # feed the input in small chunks that split lines arbitrarily, with the
+    # last line lacking its trailing newline
+    mock_sys_stdin.buffer.read1.side_effect = [
+        data[i : i + 7] for i in range(0, len(data), 7)
+    ] + [b""]
+    assert list(capture_oom_events_from_stdin()) == [
+        (1500316300, "dev37-devc", "a687af92e281", "/nail/live/yelp")
+    ]
+
+
+@patch("paasta_tools.oom_logger.capture_oom_events_from_stdin", autospec=True)
+def test_enqueue_oom_events_from_stdin(mock_capture_oom_events_from_stdin):
+    event = (1500316300, "dev37-devc", "a687af92e281", "apache2")
+    mock_capture_oom_events_from_stdin.return_value = iter([event])
+    events: queue.Queue = queue.Queue()
+    enqueue_oom_events_from_stdin(events)
+    assert events.get_nowait() == event
+    assert events.get_nowait() is None
+
+
+@patch("paasta_tools.oom_logger.capture_oom_events_from_stdin", autospec=True)
+def test_enqueue_oom_events_from_stdin_always_signals_end(
+    mock_capture_oom_events_from_stdin,
+):
+    event = (1500316300, "dev37-devc", "a687af92e281", "apache2")
+
+    def event_then_error():
+        yield event
+        raise OSError
+
+    mock_capture_oom_events_from_stdin.return_value = event_then_error()
+    events: queue.Queue = queue.Queue()
+    enqueue_oom_events_from_stdin(events)
+    assert events.get_nowait() == event
+    assert isinstance(events.get_nowait(), OSError)
+    assert events.get_nowait() is None
+
+
+def test_get_container_env_as_dict(docker_inspect, containerd_inspect):
+    docker_inspect["Config"]["Env"].append("PATH=/usr/bin")
+    assert get_container_env_as_dict(False, docker_inspect) == {
+        "PAASTA_SERVICE": "fake_service",
+        "PAASTA_INSTANCE": "fake_instance",
+        "PAASTA_RESOURCE_MEM": "512",
+        "MESOS_CONTAINER_NAME": "mesos-a04c14a6-83ea-4047-a802-92b850b1624e",
+    }
+    assert get_container_env_as_dict(True, containerd_inspect) == {
+        "PAASTA_SERVICE": "fake_service",
+        "PAASTA_INSTANCE": "fake_instance",
+        "PAASTA_RESOURCE_MEM": "512",
+    }
+
+
 @patch("paasta_tools.oom_logger.clog", autospec=True)
 def test_log_to_clog(mock_clog, log_line):
     log_to_clog(log_line)
@@ -403,11 +490,19 @@ def test_log_to_clog(mock_clog, log_line):
                 "process_name": log_line.process_name,
                 "mesos_container_id": log_line.mesos_container_id,
                 "mem_limit": log_line.mem_limit,
-            }
+            },
+            separators=(",", ":"),
         ),
     )
 
 
+@patch("paasta_tools.oom_logger.clog", autospec=True)
+def test_log_to_clog_escapes_fields(mock_clog, log_line):
+    log_to_clog(log_line._replace(process_name='python "batch\\job"'))
+    _, line = mock_clog.log_line.call_args[0]
+    assert json.loads(line)["process_name"] == 'python "batch\\job"'
+
+
 @patch("paasta_tools.oom_logger.get_instance_config", autospec=True)
 def test_send_sfx_event(mock_get_instance_config):
     service = "foo"
@@ -442,7 +537,24 @@ def test_send_sfx_event(mock_get_instance_config):
         assert mock_meteorite.create_counter.return_value.count.call_count == 1
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+@patch("paasta_tools.oom_logger.get_instance_config", autospec=True)
+def test_send_sfx_event_reuses_pool_and_counter(mock_get_instance_config):
+    from paasta_tools.oom_logger import yelp_meteorite
+
+    with patch(
+        "paasta_tools.oom_logger.yelp_meteorite",
+        autospec=None if yelp_meteorite is None else True,
+    ) as mock_meteorite:
+        send_sfx_event("foo", "bar", "baz")
+        send_sfx_event("foo", "bar", "baz")
+
+        assert mock_get_instance_config.call_count == 1
+        assert mock_meteorite.events.emit_event.call_count == 2
+        assert mock_meteorite.create_counter.call_count == 1
+        assert mock_meteorite.create_counter.return_value.count.call_count == 2
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
 @patch("paasta_tools.oom_logger.clog", autospec=True)
 @patch("paasta_tools.oom_logger.send_sfx_event", autospec=True)
 @patch("paasta_tools.oom_logger.load_system_paasta_config", autospec=True)
@@ -464,8 +576,9 @@ def test_main(
     log_line,
 ):
 
-    mock_sys_stdin.readline.side_effect = sys_stdin
+    mock_sys_stdin.buffer.read1.side_effect = sys_stdin
     mock_parse_args.return_value.containerd = False
+    mock_parse_args.return_value.cpu_affinity = None
     docker_client = Mock(inspect_container=Mock(return_value=docker_inspect))
     mock_get_docker_client.return_value = docker_client
     mock_load_system_paasta_config.return_value.get_cluster.return_value = (
@@ -480,7 +593,109 @@ def test_main(
     )
 
 
-@patch("paasta_tools.oom_logger.sys.stdin", autospec=True)
+def test_parse_args_cpu_affinity():
+    with patch("sys.argv", ["paasta_oom_logger", "--cpu-affinity", "3"]):
+        assert parse_args().cpu_affinity == 3
+    with patch("sys.argv", ["paasta_oom_logger", "--cpu-affinity", "-1"]):
+        with pytest.raises(SystemExit):
+            parse_args()
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
+@patch("paasta_tools.oom_logger.clog", autospec=True)
+@patch("paasta_tools.oom_logger.load_system_paasta_config", autospec=True)
+@patch("paasta_tools.oom_logger.get_docker_client", autospec=True)
+@patch("paasta_tools.oom_logger.os.sched_setaffinity", autospec=True)
+@patch("paasta_tools.oom_logger.parse_args", autospec=True)
+def test_main_cpu_affinity(
+    mock_parse_args,
+    mock_sched_setaffinity,
+    mock_get_docker_client,
+    mock_load_system_paasta_config,
+    mock_clog,
+    mock_sys_stdin,
+):
+    mock_sys_stdin.buffer.read1.side_effect = [b""]
+    mock_parse_args.return_value.containerd = False
+    mock_parse_args.return_value.cpu_affinity = 3
+
+    main()
+    mock_sched_setaffinity.assert_called_once_with(0, {3})
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
+@patch("paasta_tools.oom_logger.clog", autospec=True)
+@patch("paasta_tools.oom_logger.send_sfx_event", autospec=True)
+@patch("paasta_tools.oom_logger.load_system_paasta_config", autospec=True)
+@patch("paasta_tools.oom_logger.log_to_clog", autospec=True)
+@patch("paasta_tools.oom_logger.log_to_paasta", autospec=True)
+@patch("paasta_tools.oom_logger.get_docker_client", autospec=True)
+@patch("paasta_tools.oom_logger.parse_args", autospec=True)
+def test_main_inspects_each_container_once(
+    mock_parse_args,
+    mock_get_docker_client,
+    mock_log_to_paasta,
+    mock_log_to_clog,
+    mock_load_system_paasta_config,
+    mock_send_sfx_event,
+    mock_clog,
+    mock_sys_stdin,
+    docker_inspect,
+):
+    oom_line = (
+        b"1500316300 dev37-devc [30533610.306529] Task in "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79 "
+        b"killed as a result of limit of "
+        b"/docker/a687af92e281725daf5b4cda0b487f20d2055d2bb6814b76d0e39c18a52a4e79\n"
+    )
+    mock_sys_stdin.buffer.read1.side_effect = [oom_line, oom_line]
+    mock_parse_args.return_value.containerd = False
+    mock_parse_args.return_value.cpu_affinity = None
+    docker_client = Mock(inspect_container=Mock(return_value=docker_inspect))
+    mock_get_docker_client.return_value = docker_client
+
+    main()
+    docker_client.inspect_container.assert_called_once_with(resource_id="a687af92e281")
+    assert mock_log_to_clog.call_count == 2
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
+@patch("paasta_tools.oom_logger.clog", autospec=True)
+@patch("paasta_tools.oom_logger.send_sfx_event", autospec=True)
+@patch("paasta_tools.oom_logger.load_system_paasta_config", autospec=True)
+@patch("paasta_tools.oom_logger.log_to_clog", autospec=True)
+@patch("paasta_tools.oom_logger.log_to_paasta", autospec=True)
+@patch("paasta_tools.oom_logger.get_docker_client", autospec=True)
+@patch("paasta_tools.oom_logger.parse_args", autospec=True)
+def test_main_reader_error(
+    mock_parse_args,
+    mock_get_docker_client,
+    mock_log_to_paasta,
+    mock_log_to_clog,
+    mock_load_system_paasta_config,
+    mock_send_sfx_event,
+    mock_clog,
+    mock_sys_stdin,
+    sys_stdin,
+    docker_inspect,
+):
+    mock_sys_stdin.buffer.read1.side_effect = [b"".join(sys_stdin), OSError()]
+    mock_parse_args.return_value.containerd = False
+    mock_parse_args.return_value.cpu_affinity = None
+    mock_get_docker_client.return_value = Mock(
+        inspect_container=Mock(return_value=docker_inspect)
+    )
+
+    # the events read before the error are still handled, and then main()
+    # fails (so we exit non-zero) rather than acting as if stdin was closed
+    with pytest.raises(OSError):
+        main()
+    assert mock_log_to_clog.call_count == 1
+    assert mock_log_to_paasta.call_count == 1
+    assert mock_send_sfx_event.call_count == 1
+
+
+@patch("paasta_tools.oom_logger.sys.stdin")
 @patch("paasta_tools.oom_logger.clog", autospec=True)
 @patch("paasta_tools.oom_logger.send_sfx_event", autospec=True)
 @patch("paasta_tools.oom_logger.load_system_paasta_config", autospec=True)
@@ -489,7 +704,14 @@ def test_main(
 @patch("paasta_tools.oom_logger.parse_args", autospec=True)
 @patch("paasta_tools.oom_logger.get_containerd_container", autospec=True)
 @patch("paasta_tools.oom_logger.json.loads", autospec=True)
+@patch(
+    "containerd.services.containers.v1.containers_pb2_grpc.ContainersStub",
+    autospec=True,
+)
+@patch("grpc.insecure_channel", autospec=True)
 def test_main_containerd(
+    mock_insecure_channel,
+    mock_containers_stub,
     mock_json_loads,
     mock_get_containerd_container,
     mock_parse_args,
@@ -504,13 +726,13 @@ def test_main_containerd(
     containerd_inspect,
 ):
 
-    mock_sys_stdin.readline.side_effect = (
+    mock_sys_stdin.buffer.read1.side_effect = (
         sys_stdin_kubernetes_containerd_systemd_cgroup_structured
     )
     mock_parse_args.return_value.containerd = True
+    mock_parse_args.return_value.cpu_affinity = None
 
     mock_container_info = MagicMock()
-    mock_container_info.spec.value.decode.return_value = str(containerd_inspect)
 
     mock_get_containerd_container.return_value = mock_container_info
     mock_json_loads.return_value = containerd_inspect
@@ -520,6 +742,13 @@ def test_main_containerd(
     )
 
     main()
+    mock_containers_stub.assert_called_once_with(mock_insecure_channel.return_value)
+    mock_get_containerd_container.assert_called_once_with(
+        mock_containers_stub.return_value,
+        "e216d2f1e6c625d363c71edb6b3cbab5a9e1b447641b61028d0b94b077adf27c",
+    )
+    mock_insecure_channel.return_value.close.assert_called_once_with()
+    mock_json_loads.assert_called_once_with(mock_container_info.spec.value)
     mock_log_to_paasta.assert_called_once_with(log_line_containerd)
     mock_log_to_clog.assert_called_once_with(log_line_containerd)
     mock_send_sfx_event.assert_called_once_with(
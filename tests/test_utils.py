@@ -270,6 +270,45 @@ def test_get_log_name_for_service():
     assert utils.get_log_name_for_service(service) == expected
 
 
+def test_time_cache():
+    mock_f = mock.Mock(side_effect=lambda key: key.upper())
+    cached_f = utils.time_cache(ttl=30)(mock_f)
+    with freeze_time("2024-01-01 00:00:00") as frozen_time:
+        assert cached_f("a") == "A"
+        assert cached_f("a") == "A"
+        assert mock_f.call_count == 1
+        frozen_time.tick(31)
+        assert cached_f("a") == "A"
+        assert mock_f.call_count == 2
+        cached_f.cache_clear()
+        cached_f("a")
+        assert mock_f.call_count == 3
+
+
+def test_time_cache_maxsize():
+    cache = utils.time_cache(ttl=30, maxsize=2)
+    mock_f = mock.Mock(side_effect=lambda key: key.upper())
+    cached_f = cache(mock_f)
+    with freeze_time("2024-01-01 00:00:00") as frozen_time:
+        cached_f("a")
+        frozen_time.tick(10)
+        cached_f("b")
+        cached_f("c")
+        # the oldest entry makes way once there are more than maxsize of them
+        assert list(cache.configs) == [("b",), ("c",)]
+        assert cached_f("a") == "A"
+        assert mock_f.call_count == 4
+        assert list(cache.configs) == [("c",), ("a",)]
+
+        # expired entries are dropped without having to be looked up again
+        frozen_time.tick(10)
+        cached_f("d")
+        frozen_time.tick(25)
+        cached_f("e")
+        assert list(cache.configs) == [("d",), ("e",)]
+        assert mock_f.call_count == 6
+
+
 def test_get_readable_files_in_glob_ignores_unreadable(tmpdir):
     tmpdir.join("readable.json").ensure().chmod(0o644)
     tmpdir.join("unreadable.json").ensure().chmod(0o000)